@@ -0,0 +1,224 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mido import MidiFile, MidiTrack, MetaMessage, Message
+
+import lazylip
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Benchmark sizes: song length in seconds for each case unless --seconds is given
+DEFAULT_SECONDS = [60, 240, 900]
+EXTRA_TRACK_NAMES = ['PART DRUMS', 'PART BASS', 'PART GUITAR', 'PART KEYS', 'PART REAL_KEYS_X', 'EVENTS', 'VENUE']
+
+def generate_chart(midi_path, seconds=240, bpm=120, ticks_per_beat=480, beats_per_bar=4,
+                   notes_per_second=2.0, overlap_rate=0.1, extra_tracks=4, seed=0):
+    """
+    Writes a synthetic Encore style chart: a tempo track, a BEAT track with a down beat (note 12)
+    every beats_per_bar beats, pad vocals in 96-100 at roughly notes_per_second, and extra_tracks
+    instrument tracks. overlap_rate is the chance a vocal note gets a second note at the same start.
+    Returns the number of vocal notes written.
+    """
+    rng = random.Random(seed)
+    ticks_per_second = ticks_per_beat * bpm / 60
+    song_ticks = int(seconds * ticks_per_second)
+    mid = MidiFile(ticks_per_beat=ticks_per_beat)
+
+    tempo_track = MidiTrack()
+    tempo_track.append(MetaMessage('track_name', name='lazylip benchmark', time=0))
+    tempo_track.append(MetaMessage('set_tempo', tempo=int(60_000_000 / bpm), time=0))
+    mid.tracks.append(tempo_track)
+
+    def add_track(name, events):
+        track = MidiTrack()
+        track.append(MetaMessage('track_name', name=name, time=0))
+        previous_time = 0
+        for abs_time, _, msg in sorted(events, key=lambda event: event[:2]):
+            track.append(msg.copy(time=abs_time - previous_time))
+            previous_time = abs_time
+        mid.tracks.append(track)
+
+    def random_notes(pitches, per_second, overlap=0.0):
+        events = []
+        abs_time = 0
+        mean_gap = ticks_per_second / per_second
+        while True:
+            abs_time += max(1, int(rng.expovariate(1 / mean_gap)))
+            if abs_time >= song_ticks:
+                return events
+            # Mix of short (< 120 ticks) and sustained notes
+            duration = rng.choice([30, 60, 90, 119]) if rng.random() < 0.6 else rng.randint(120, ticks_per_beat * 2)
+            note = rng.choice(pitches)
+            stacked = [note]
+            if rng.random() < overlap:
+                stacked.append(rng.choice([p for p in pitches if p != note] or pitches))
+            for pitch in stacked:
+                events.append((abs_time, 1, Message('note_on', note=pitch, velocity=100)))
+                events.append((abs_time + duration, 0, Message('note_off', note=pitch, velocity=0)))
+            abs_time += duration
+
+    vocal_events = random_notes(range(96, 101), notes_per_second, overlap_rate)
+    vocal_events.append((0, 2, MetaMessage('text', text='[idle]')))
+    add_track('PART VOCALS', vocal_events)
+
+    for index in range(extra_tracks):
+        name = EXTRA_TRACK_NAMES[index % len(EXTRA_TRACK_NAMES)]
+        if index >= len(EXTRA_TRACK_NAMES):
+            name += f' {index}'
+        add_track(name, random_notes(range(60, 101), notes_per_second * 4))
+
+    beat_events = []
+    for beat, abs_time in enumerate(range(0, song_ticks, ticks_per_beat)):
+        note = 12 if beat % beats_per_bar == 0 else 13
+        beat_events.append((abs_time, 1, Message('note_on', note=note, velocity=100)))
+        beat_events.append((abs_time + ticks_per_beat // 8, 0, Message('note_off', note=note, velocity=0)))
+    add_track('BEAT', beat_events)
+
+    mid.save(midi_path)
+    return sum(1 for _, _, msg in vocal_events if msg.type == 'note_on')
+
+def peak_rss_kb():
+    """
+    Returns the peak resident set size of this process in KB, or None where resource is missing.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # macOS reports bytes
+
+def run_case(sources, repeat, work_dir):
+    """
+    Converts each of the generated charts in sources repeat times in this process.
+    Runs inside a fresh worker process that does nothing but convert, so the peak RSS belongs to
+    the converter and this case only.
+    """
+    logging.getLogger('lazylip').setLevel(logging.WARNING)
+    stages = {}
+    elapsed = 0.0
+    target = os.path.join(work_dir, 'notes.mid')
+    for _ in range(repeat):
+        for source in sources:
+            shutil.copyfile(source, target)
+            report = {}
+            started = time.perf_counter()
+            lazylip.process_midi_file(target, report=report)
+            elapsed += time.perf_counter() - started
+            for name, record in report['stages'].items():
+                stages[name] = stages.get(name, 0.0) + record['elapsed']
+    return elapsed, stages, peak_rss_kb()
+
+def benchmark_case(case, files, repeat, seed):
+    """
+    Generates files charts for one case in this process, then converts them in a fresh worker
+    process (see run_case) and returns the results of the case.
+    """
+    work_dir = tempfile.mkdtemp(prefix='lazylip-bench-')
+    try:
+        sources = []
+        notes = 0
+        for index in range(files):
+            source = os.path.join(work_dir, f'source_{index}.mid')
+            notes += generate_chart(source, seed=seed + index, **case)
+            sources.append(source)
+        source_bytes = sum(os.path.getsize(source) for source in sources)
+
+        # A spawned (not forked) process per case starts from a fresh interpreter, so its peak RSS holds
+        # neither the generator's memory nor that of earlier cases
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            elapsed, stages, peak_rss = executor.submit(run_case, sources, repeat, work_dir).result()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    runs = files * repeat
+    return {
+        'case': case,
+        'files': files,
+        'repeat': repeat,
+        'vocal_notes': notes,
+        'mean_file_bytes': source_bytes // files,
+        'elapsed': round(elapsed, 6),
+        'files_per_sec': round(runs / elapsed, 3),
+        'notes_per_sec': round(notes * repeat / elapsed, 1),
+        'mean_stage_seconds': {name: round(total / runs, 6) for name, total in stages.items()},
+        'peak_rss_kb': peak_rss,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    baseline_cases = {json.dumps(case['case'], sort_keys=True): case for case in (baseline or {}).get('cases', [])}
+    for result in results['cases']:
+        case = result['case']
+        line = (f"{case['seconds']:>5}s song, {result['vocal_notes'] // result['files']:>6} notes, "
+                f"{case['extra_tracks']} extra tracks: {result['files_per_sec']:8.2f} files/sec, "
+                f"{result['notes_per_sec']:10.0f} notes/sec, peak RSS {result['peak_rss_kb']} KB")
+        previous = baseline_cases.get(json.dumps(case, sort_keys=True))
+        if previous:
+            line += f"  ({result['files_per_sec'] / previous['files_per_sec']:.2f}x vs {baseline.get('commit')})"
+        print(line)
+        stages = ', '.join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in result['mean_stage_seconds'].items())
+        print(f"        {stages}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark lazylip.py on synthetic Encore style charts.")
+    parser.add_argument('--seconds', type=int, nargs='+', default=DEFAULT_SECONDS,
+                        help=f"Song lengths to benchmark, one case each (default: {DEFAULT_SECONDS})")
+    parser.add_argument('--beats-per-bar', type=int, default=4,
+                        help="BEAT density: beats between down beats (default: 4)")
+    parser.add_argument('--notes-per-second', type=float, default=2.0,
+                        help="Average PART VOCALS notes per second in 96-100 (default: 2.0)")
+    parser.add_argument('--overlap-rate', type=float, default=0.1,
+                        help="Chance of a second vocal note at the same start time (default: 0.1)")
+    parser.add_argument('--extra-tracks', type=int, default=4,
+                        help="Number of extra instrument tracks (default: 4)")
+    parser.add_argument('--files', type=int, default=3, help="Charts generated per case (default: 3)")
+    parser.add_argument('--repeat', type=int, default=3, help="Conversions per chart (default: 3)")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the chart generator (default: 0)")
+    parser.add_argument('-o', '--output', default='bench_output.json',
+                        help="Where to save the JSON results (default: bench_output.json)")
+    parser.add_argument('--compare', help="Earlier JSON results to compare files/sec against")
+    args = parser.parse_args(argv)
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': [],
+    }
+    for seconds in args.seconds:
+        case = {'seconds': seconds, 'beats_per_bar': args.beats_per_bar, 'notes_per_second': args.notes_per_second,
+                'overlap_rate': args.overlap_rate, 'extra_tracks': args.extra_tracks}
+        results['cases'].append(benchmark_case(case, args.files, args.repeat, args.seed))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as infile:
+            baseline = json.load(infile)
+    print_results(results, baseline)
+
+    with open(args.output, 'w', encoding='utf-8') as outfile:
+        json.dump(results, outfile, indent=2)
+    print(f"Saved results to {args.output}")
+
+if __name__ == "__main__":
+    main()
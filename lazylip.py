@@ -1,7 +1,29 @@
+import argparse
+import fnmatch
+import glob
+import hashlib
+import heapq
+import json
+import logging
 import os
 import random
-import mido
-from mido import MidiFile, MidiTrack, MetaMessage, Message
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+from contextlib import contextmanager
+from functools import partial
+from io import BytesIO
+from operator import itemgetter
+
+# mido, multiprocessing, cProfile and tracemalloc are imported inside the functions that use them, so
+# usage errors, skipped files and cache hits don't pay for them at startup.
+
+logger = logging.getLogger('lazylip')
 
 # Expanded list of words to simulate different mouth movements
 mouth_movement_words = [
@@ -36,6 +58,11 @@ mouth_movement_words = [
     "lo", "me", "ba", "fa", "ho", "wo", "ye", "ra", "le", "mo", "po", "so"
 ]
 
+# Word table the lyrics are drawn from: the list above without its duplicates, in first seen order
+LYRIC_WORDS = tuple(dict.fromkeys(mouth_movement_words))
+LYRIC_BATCH = 4096         # Words drawn from the generator per call
+DEFAULT_SEED = 0           # Base seed mixed into every file's lyric seed
+
 # Configuration Parameters
 MIN_PHRASE_LENGTH = 1200    # Minimum phrase length in ticks
 SHORT_NOTE_THRESHOLD = 119   # Notes with duration <=119 ticks are short
@@ -43,325 +70,713 @@ LONG_NOTE_THRESHOLD = 120    # Notes with duration >=120 ticks are long
 GAP_THRESHOLD = 20         # Gap in ticks to reset '+' assignment
 PHRASE_GAP_THRESHOLD = 0 # Gap in ticks to reset '+' assignment
 
-# Step 1.5: Remove overlapping notes in 'PART VOCALS' track
-def remove_overlapping_notes(midi, track_name, note_range):
-    """
-    Removes notes within note_range from the specified track that start at the same time as another note.
-    """
-    for track in midi.tracks:
-        if track_name.upper() in track.name.upper():
-            print(f"Processing '{track_name}' track for overlapping notes.")
-            abs_time = 0
-            start_time_notes = {}
-            overlapping_start_times = set()
-            note_on_times = {}  # Track the start times of note_on events
-            active_notes = {}  # Track active notes with their time to ensure proper pairing
-
-            # First pass: Collect all note_on events within the note_range
-            for msg in track:
-                abs_time += msg.time
-                if msg.type == 'note_on' and msg.note in note_range and msg.velocity > 0:
-                    if abs_time in start_time_notes:
-                        # Overlapping start time; mark this time for removal
-                        overlapping_start_times.add(abs_time)
-                        start_time_notes[abs_time].append(msg.note)
-                    else:
-                        start_time_notes[abs_time] = [msg.note]
-                    # Track note_on time to pair with note_off later
-                    note_on_times[msg.note] = abs_time
-                    active_notes[msg.note] = abs_time  # Track active note and time
-
-            if not overlapping_start_times:
-                print("No overlapping notes found in the specified range.")
-                return
+# Pad lanes of the source PART VOCALS, by the lowest note of their five notes
+PAD_LANES = {'expert': 96, 'hard': 84, 'medium': 72, 'easy': 60}
+LANE_WIDTH = 5
+PITCHED_LANE = 78          # Every pad lane is moved onto the pitched window 78-82
+# (track name, pad lane) of every generated track, in the order they are written
+DEFAULT_OUTPUT_LANES = (('PART VOCALS', PAD_LANES['expert']),)
+HARMONY_TRACKS = ('HARM1', 'HARM2', 'HARM3')
+VOCAL_TRACK_NAMES = ('PART VOCALS', *HARMONY_TRACKS)
+
+# Magma vocal rules checked by the validator
+PITCHED_RANGE = range(36, 85)            # Sung notes must be within 36-84
+PHRASE_NOTES = (105, 106)                # Phrase markers
+VOCAL_CONTROL_NOTES = {0, 1, 96, 97, *PHRASE_NOTES}  # Lyric and range shifts, percussion and phrases
+DEFAULT_HARMONY_LANES = ('expert', 'hard', 'medium')
+
+# Event assembly: events at the same tick are ordered note_off, note_on, text, anything else,
+# and within a rank by stream (source notes first, then carried over events, lyrics and phrases)
+EVENT_RANK_BITS = 2
+NOTE_OFF_RANK, NOTE_ON_RANK, TEXT_RANK, OTHER_RANK = range(4)
+(NOTE_OFF_STREAM, NOTE_ON_STREAM, OTHER_TEXT_STREAM, OTHER_STREAM,
+ LYRIC_STREAM, PHRASE_ON_STREAM, PHRASE_OFF_STREAM) = range(7)
+
+# Sequencer specific meta data written after the track name of generated vocals tracks
+CONVERTED_MARKER = b'lazy-lip'
+
+# Result cache settings
+CACHE_VERSION = 6          # Bump whenever a change alters the generated track for the same input
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'lazylip')
+DEFAULT_CACHE_SIZE_MB = 256
+
+# Batch pipeline
+DEFAULT_IO_THREADS = 4      # Reader and writer threads each, for slow or network mounted libraries
+IN_FLIGHT_PER_WORKER = 2    # Files read ahead per worker process, bounds the buffered bytes
+VALIDATE_CHUNKSIZE = 16     # Files sent to a worker at once by --validate
+
+# Watch mode
+WATCH_INTERVAL = 0.2        # Seconds between polls of the watched paths
+WATCH_DEBOUNCE = 0.3        # Seconds a file's size and mtime must stay unchanged before it is converted
+
+# Syllable length classes stored in NoteIntervals.kinds
+SHORT, MEDIUM, LONG = 0, 1, 2
+
+class VocalNotes:
+    """
+    Columnar store of the shifted vocal note events in stream order: parallel arrays of
+    absolute time, pitch, velocity, channel and message type (1 for note_on, 0 for note_off).
+    """
+    __slots__ = ('times', 'pitches', 'velocities', 'channels', 'types')
 
-            print(f"Found {len(overlapping_start_times)} start times with overlapping notes to remove.")
-
-            # Second pass: Remove the identified overlapping notes and corresponding note_off events
-            abs_time = 0
-            new_track = MidiTrack()
-            notes_kept_at_time = set()
-            removed_notes = set()  # Track notes removed so their corresponding note_off can also be removed
-
-            for msg in track:
-                current_time = msg.time
-                abs_time += current_time
-                remove_msg = False
-
-                if msg.type == 'note_on' and msg.note in note_range and msg.velocity > 0:
-                    if abs_time in overlapping_start_times:
-                        if abs_time not in notes_kept_at_time:
-                            notes_kept_at_time.add(abs_time)
-                            print(f"Keeping first note_on: Note {msg.note} at time {abs_time}")
-                        else:
-                            remove_msg = True
-                            removed_notes.add(msg.note)  # Mark this note for removal
-                            print(f"Removing subsequent note_on: Note {msg.note} at time {abs_time}")
-                            active_notes.pop(msg.note, None)  # Remove from active notes when removing
-                elif msg.type == 'note_off' and msg.note in note_range:
-                    # Only remove note_off if its corresponding note_on was removed
-                    if msg.note in removed_notes:
-                        remove_msg = True  # Remove this note_off if its corresponding note_on was removed
-                        removed_notes.discard(msg.note)  # Remove the note from the removed list after processing
-                        print(f"Removing note_off: Note {msg.note} at time {abs_time}")
-                    else:
-                        print(f"Keeping note_off: Note {msg.note} at time {abs_time}")
-                    # Ensure the note is no longer active once a note_off is encountered
-                    active_notes.pop(msg.note, None)
+    def __init__(self):
+        self.times = array('i')
+        self.pitches = array('b')
+        self.velocities = array('b')
+        self.channels = array('b')
+        self.types = array('b')
 
-                if not remove_msg:
-                    new_track.append(msg)
-                else:
-                    # Adjust the time of subsequent messages to preserve timing
-                    if new_track:
-                        new_track[-1].time += current_time
-                    else:
-                        new_track.append(MetaMessage('track_name', name=track.name, time=0))
+    def __len__(self):
+        return len(self.times)
 
-            # Replace the original track with the new track
-            midi.tracks.remove(track)
-            midi.tracks.append(new_track)
-            print(f"Removed overlapping notes from '{track_name}' track.")
-            break
-    else:
-        print(f"Track '{track_name}' not found in the MIDI file.")
+    def append(self, abs_time, msg, pitch):
+        self.times.append(abs_time)
+        self.pitches.append(pitch)
+        self.velocities.append(msg.velocity)
+        self.channels.append(msg.channel)
+        self.types.append(msg.type == 'note_on')
 
-def process_midi_file(midi_path):
-    print(f"Processing {midi_path}")
-    mid = MidiFile(midi_path)
+    def is_note_on(self, index):
+        return self.types[index] and self.velocities[index] > 0
 
-    # Create a new track for PART VOCALS
-    new_track = MidiTrack()
-    new_track.append(MetaMessage('track_name', name='PART VOCALS', time=0))
+class NoteIntervals:
+    """
+    Columnar store of paired syllables: parallel arrays of start, end, pitch and length class.
+    The length classes are computed for all durations at once when the store is built.
+    """
+    __slots__ = ('starts', 'ends', 'pitches', 'kinds')
 
-    messages_with_abs_time = []
-    note_events = []
-    text_events = {}
-    beat_times = []
-
-    # Step 1: Identify BEAT track and collect down beat times
-    for track in mid.tracks:
-        if 'BEAT' in track.name.upper():
-            total_time = 0
-            for msg in track:
-                total_time += msg.time
-                if msg.type == 'note_on' and msg.note == 12 and msg.velocity > 0:
-                    beat_times.append(total_time)
-            break  # Assuming only one BEAT track
+    def __init__(self, starts=(), ends=(), pitches=()):
+        self.starts = array('i', starts)
+        self.ends = array('i', ends)
+        self.pitches = array('b', pitches)
+        self.kinds = classify_durations(self.starts, self.ends)
 
-    if not beat_times:
-        print(f"No down beats (note 12) found in BEAT track for {midi_path}. Cannot determine phrases.")
-        return
+    def __len__(self):
+        return len(self.starts)
 
-    # Sort beat_times to ensure they are in ascending order
-    beat_times = sorted(beat_times)
+def classify_durations(starts, ends):
+    """
+    Classifies every start/end pair as SHORT, MEDIUM or LONG in a single pass over the columns.
+    """
+    return array('b', [LONG if end - start >= LONG_NOTE_THRESHOLD
+                       else SHORT if end - start <= SHORT_NOTE_THRESHOLD
+                       else MEDIUM
+                       for start, end in zip(starts, ends)])
+
+# Standard MIDI File chunk access: only the tracks the converter needs are decoded by mido,
+# every other chunk is kept as a memoryview into the file bytes and written back untouched.
+def read_midi_chunks(data):
+    """
+    Splits Standard MIDI File bytes into (file_type, division, chunks).
+    division is the raw 2 byte timing field of the header and each chunk is a memoryview
+    covering the chunk header plus its data, so it can be written back verbatim.
+    """
+    view = memoryview(data)
+    if len(view) < 14 or view[:4] != b'MThd':
+        raise OSError('MThd not found. Probably not a MIDI file')
+    header_size = int.from_bytes(view[4:8], 'big')
+    file_type = int.from_bytes(view[8:10], 'big')
+    division = bytes(view[12:14])
 
-    remove_overlapping_notes(mid, track_name='PART VOCALS', note_range=range(96, 101))
+    return file_type, division, split_chunks(view, 8 + header_size)
 
-    # Step 2: Process PART VOCALS track
-    for track in mid.tracks:
-        if 'PART VOCALS' in track.name.upper():
-            total_time = 0
-            for msg in track:
-                total_time += msg.time
+def split_chunks(view, pos=0):
+    """
+    Splits the chunks starting at pos of a memoryview into a list of memoryviews, one per chunk.
+    """
+    chunks = []
+    while pos + 8 <= len(view):
+        end = pos + 8 + int.from_bytes(view[pos + 4:pos + 8], 'big')
+        if end > len(view):
+            raise EOFError(f"Chunk at byte {pos} runs past the end of the file")
+        chunks.append(view[pos:end])
+        pos = end
+    return chunks
+
+def _read_variable_int(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7f)
+        if byte < 0x80:
+            return value, pos
+
+def raw_events(chunk):
+    """
+    Walks the events of an MTrk chunk without decoding them, yielding (absolute_time, status, meta_type, data).
+    meta_type is None for non-meta events and data is a memoryview of the event's data bytes.
+    Stops at end_of_track or at the end of the chunk.
+    """
+    pos = 8
+    end = len(chunk)
+    status = None
+    abs_time = 0
+    while pos < end:
+        delta, pos = _read_variable_int(chunk, pos)
+        abs_time += delta
+        byte = chunk[pos]
+        if byte == 0xff:
+            meta_type = chunk[pos + 1]
+            length, pos = _read_variable_int(chunk, pos + 2)
+            if meta_type == 0x2f:
+                return
+            yield abs_time, 0xff, meta_type, chunk[pos:pos + length]
+            pos += length
+        elif byte in (0xf0, 0xf7):
+            length, pos = _read_variable_int(chunk, pos + 1)
+            yield abs_time, byte, None, chunk[pos:pos + length]
+            pos += length
+        else:
+            if byte & 0x80:
+                status = byte
+                pos += 1
+            elif status is None:
+                raise OSError('running status without last_status')
+            if status < 0xf0:
+                length = 1 if 0xc0 <= status <= 0xdf else 2
+            else:
+                length = {0xf1: 1, 0xf2: 2, 0xf3: 1}.get(status, 0)
+            yield abs_time, status, None, chunk[pos:pos + length]
+            pos += length
 
-                # Skip original 'track_name' messages
-                if msg.type == 'track_name':
-                    continue
+def scan_track_name(chunk):
+    """
+    Returns the first track_name of an MTrk chunk without decoding its other events ('' if none).
+    Only event lengths are parsed, so a name at the start of the track is found in O(1).
+    """
+    if chunk[:4] != b'MTrk':
+        return None
+    for _, status, meta_type, data in raw_events(chunk):
+        if meta_type == 0x03:
+            return bytes(data).decode('latin1')
+    return ''
+
+def is_converted_track(chunk, head_only=False):
+    """
+    Tells whether a PART VOCALS chunk is lazy-lip output.
+    The marker written after the track name is checked first, which only touches the first events.
+    Tracks without it (older output) are recognised by having phrase markers and lyrics but no pad notes.
+    With head_only the chunk may be a truncated prefix and only the marker is looked for.
+    """
+    has_phrases = has_lyrics = False
+    try:
+        for index, (_, status, meta_type, data) in enumerate(raw_events(chunk)):
+            if meta_type == 0x7f and bytes(data) == CONVERTED_MARKER:
+                return True
+            if head_only and index >= 2:
+                return False
+            if meta_type in (0x01, 0x05):
+                has_lyrics = True
+            elif status & 0xf0 == 0x90 and data[1] > 0:
+                if 96 <= data[0] <= 100:
+                    return False  # Still has pad notes to convert
+                if data[0] == 105:
+                    has_phrases = True
+    except IndexError:
+        # Truncated prefix read by is_converted_file
+        return False
+    return has_phrases and has_lyrics
+
+def find_source_tracks(chunks):
+    """
+    Returns (vocal_indices, beat_index): the indices of the PART VOCALS chunks and of the BEAT chunk (None if missing).
+    """
+    track_names = [scan_track_name(chunk) for chunk in chunks]
+    vocal_indices = [i for i, name in enumerate(track_names) if name is not None and 'PART VOCALS' in name.upper()]
+    beat_index = next((i for i, name in enumerate(track_names) if name is not None and 'BEAT' in name.upper()), None)  # Assuming only one BEAT track
+    return vocal_indices, beat_index
 
-                # Create a copy of the message with time set to 0
-                msg_copy = msg.copy(time=0)
-
-                if msg.type in ['note_on', 'note_off']:
-                    is_note_on = msg.type == 'note_on' and msg.velocity > 0
-                    is_note_off = msg.type == 'note_off' or (msg.type == 'note_on' and msg.velocity == 0)
-
-                    # Filter notes between 96 and 100, or note 116
-                    if 96 <= msg.note <= 100:
-                        if 96 <= msg.note <= 100:
-                            # Move the note down by 18 semitones
-                            msg_copy.note -= 18
-
-                        # Collect the modified message
-                        messages_with_abs_time.append((total_time, msg_copy))
-
-                        # Collect note events for syllable processing (both note_on and note_off)
-                        if 78 <= msg_copy.note <= 82:
-                            note_events.append({
-                                'time': total_time,
-                                'msg': msg_copy,
-                                'is_note_on': is_note_on,
-                                'is_note_off': is_note_off
-                            })
-                    #elif msg.note == 116:
-                    #    # Keep note 116 as is
-                    #    messages_with_abs_time.append((total_time, msg_copy))
-                else:
-                    # Include other messages as is
-                    messages_with_abs_time.append((total_time, msg_copy))
+def is_converted_file(midi_path):
+    """
+    Checks whether midi_path already holds lazy-lip output by reading only the chunk headers
+    and the first bytes of each track.
+    """
+    try:
+        with open(midi_path, 'rb') as infile:
+            header = infile.read(14)
+            if len(header) < 14 or header[:4] != b'MThd':
+                return False
+            infile.seek(8 + int.from_bytes(header[4:8], 'big'))
+            while True:
+                chunk_header = infile.read(8)
+                if len(chunk_header) < 8:
+                    return False
+                size = int.from_bytes(chunk_header[4:8], 'big')
+                head = memoryview(chunk_header + infile.read(min(size, 256)))
+                try:
+                    name = scan_track_name(head)
+                except IndexError:
+                    name = None  # No track name in the first bytes
+                if name is not None and 'PART VOCALS' in name.upper():
+                    return is_converted_track(head, head_only=True)
+                infile.seek(8 + size - len(head), os.SEEK_CUR)
+    except OSError:
+        return False
+
+def decode_track(chunk):
+    """
+    Decodes a single MTrk chunk into a mido MidiTrack.
+    """
+    from mido import MidiFile
+    header = b'MThd' + struct.pack('>Lhhh', 6, 1, 1, 480)
+    return MidiFile(file=BytesIO(header + chunk)).tracks[0]
 
-    # Step 3: Identify syllables from long and short notes
-    if note_events:
-        intervals = []
-        current_notes = {}
-
-        for event in note_events:
-            note = event['msg'].note
-            if event['is_note_on']:
-                if note not in current_notes:
-                    current_notes[note] = []
-                current_notes[note].append(event['time'])
-            elif event['is_note_off']:
-                if note in current_notes and current_notes[note]:
-                    start_time = current_notes[note].pop(0)  # FIFO for pairing
-                    duration = event['time'] - start_time
-                    if duration >= LONG_NOTE_THRESHOLD:
-                        intervals.append({'start': start_time, 'end': event['time'], 'duration': duration, 'type': 'long'})
-                    elif duration <= SHORT_NOTE_THRESHOLD:
-                        intervals.append({'start': start_time, 'end': event['time'], 'duration': duration, 'type': 'short'})
-                    else:
-                        intervals.append({'start': start_time, 'end': event['time'], 'duration': duration, 'type': 'medium'})
-                else:
-                    # Note_off without a matching note_on
-                    print(f"Warning: Note_off for note {note} at time {event['time']} without matching note_on.")
+def encode_track(track):
+    """
+    Encodes a mido MidiTrack into the bytes of a complete MTrk chunk.
+    """
+    from mido import MidiFile
+    buffer = BytesIO()
+    midi = MidiFile(type=1)
+    midi.tracks.append(track)
+    midi.save(file=buffer)
+    return buffer.getvalue()[14:]  # Drop the MThd chunk
+
+def midi_file_pieces(file_type, division, chunks):
+    """
+    Returns the pieces of a Standard MIDI File built from raw chunks: the MThd chunk, counting
+    the MTrk chunks for the header, followed by the chunks themselves.
+    """
+    track_count = sum(1 for chunk in chunks if chunk[:4] == b'MTrk')
+    return [b'MThd' + struct.pack('>LHH', 6, file_type, track_count) + division, *chunks]
 
-        # After processing all events, check for any unmatched note_on events
-        for note, times in current_notes.items():
-            for start_time in times:
-                print(f"Warning: Note_on for note {note} at time {start_time} has no matching note_off.")
+def write_midi_chunks(midi_path, file_type, division, chunks):
+    """
+    Writes a Standard MIDI File from raw chunks (see midi_file_pieces).
+    """
+    write_atomic(midi_path, midi_file_pieces(file_type, division, chunks))
 
-        # Sort intervals by start time
-        intervals_sorted = sorted(intervals, key=lambda x: x['start'])
+def write_atomic(path, pieces):
+    """
+    Writes the byte strings in pieces to a file next to path and renames it over path,
+    so readers never see a partial file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as outfile:
+            for piece in pieces:
+                outfile.write(piece)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+# Result cache: the generated vocal chunks are stored on disk keyed by the source tracks and settings
+def cache_key(beat_chunk, vocal_chunks, seed=DEFAULT_SEED, output_lanes=DEFAULT_OUTPUT_LANES):
+    """
+    Hashes the BEAT and PART VOCALS chunk bytes together with the seed, the output tracks and every
+    setting that shapes the output.
+    """
+    settings = (CACHE_VERSION, MIN_PHRASE_LENGTH, SHORT_NOTE_THRESHOLD, LONG_NOTE_THRESHOLD,
+                GAP_THRESHOLD, PHRASE_GAP_THRESHOLD, PITCHED_LANE, LYRIC_WORDS, seed, tuple(output_lanes))
+    digest = hashlib.sha256(repr(settings).encode())
+    for chunk in [beat_chunk, *vocal_chunks]:
+        digest.update(len(chunk).to_bytes(8, 'big'))
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def lyric_seed(vocal_chunks, seed=DEFAULT_SEED, lane=PAD_LANES['expert']):
+    """
+    Derives the lyric seed of a file from the bytes of its source PART VOCALS tracks and the base seed,
+    so the same chart always gets the same words in any process. Lanes other than Expert get their own seed.
+    """
+    digest = hashlib.sha256(str(seed).encode() if lane == PAD_LANES['expert'] else f"{seed}/{lane}".encode())
+    for chunk in vocal_chunks:
+        digest.update(chunk)
+    return int.from_bytes(digest.digest()[:8], 'big')
 
-        #print(f"Minimum note length set to: {LONG_NOTE_THRESHOLD} ticks")
-        #print(f"Number of long notes (duration >= {LONG_NOTE_THRESHOLD} ticks): {sum(1 for interval in intervals if interval['type'] == 'long')}")
-        #print(f"Number of short notes (duration <= {SHORT_NOTE_THRESHOLD} ticks): {sum(1 for interval in intervals if interval['type'] == 'short')}")
-        #print(f"Number of medium notes (duration > {SHORT_NOTE_THRESHOLD} and < {LONG_NOTE_THRESHOLD} ticks): {sum(1 for interval in intervals if interval['type'] == 'medium')}")
-    else:
-        print("No note events found in PART VOCALS track.")
+def lyric_words(seed):
+    """
+    Yields an endless, reproducible stream of words drawn from LYRIC_WORDS in batches of LYRIC_BATCH.
+    """
+    rng = random.Random(seed)
+    while True:
+        yield from rng.choices(LYRIC_WORDS, k=LYRIC_BATCH)
 
-    # Step 4: Define phrases based on beat_times and assign notes to phrases
-    phrases = []  # List of [start_time, end_time]
-    note_index = 0
-    total_notes = len(intervals_sorted)
+def source_key(midi_path, seed=DEFAULT_SEED, output_lanes=DEFAULT_OUTPUT_LANES):
+    """
+    Returns the cache key of the BEAT and PART VOCALS tracks of midi_path, or None when its PART VOCALS
+    is already converted. Lets watch mode tell edits to the vocals from saves that only touch other tracks.
+    """
+    with open(midi_path, 'rb') as infile:
+        data = infile.read()
+    _, _, chunks = read_midi_chunks(data)
+    vocal_indices, beat_index = find_source_tracks(chunks)
+    if any(is_converted_track(chunks[i]) for i in vocal_indices):
+        return None
+    return cache_key(chunks[beat_index] if beat_index is not None else b'', [chunks[i] for i in vocal_indices],
+                     seed, output_lanes)
+
+class ResultCache:
+    """
+    On-disk cache of the generated vocal chunks of a file, one file per key holding the chunks back to back.
+    Hits refresh the entry's mtime and trim() evicts the least recently used entries
+    until the cache fits in max_bytes. Instances are plain data so they can be sent to worker processes.
+    """
 
-    previous_phrase_end = None  # Track the end time of the last phrase
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.mtrk')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as infile:
+                data = infile.read()
+            os.utime(path)
+        except OSError:
+            return None
+        # Ignore truncated or foreign files, they are overwritten on the next put()
+        try:
+            chunks = split_chunks(memoryview(data))
+        except EOFError:
+            return None
+        if not chunks or sum(map(len, chunks)) != len(data) or any(chunk[:4] != b'MTrk' for chunk in chunks):
+            return None
+        return chunks
+
+    def put(self, key, chunks):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as outfile:
+            for chunk in chunks:
+                outfile.write(chunk)
+        os.replace(temp_path, path)  # Atomic, so parallel workers never see a partial entry
+
+    def entries(self):
+        try:
+            with os.scandir(self.directory) as scan:
+                return [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                        for entry in scan if entry.name.endswith('.mtrk')]
+        except FileNotFoundError:
+            return []
+
+    def trim(self):
+        """
+        Evicts least recently used entries until the cache is no larger than max_bytes.
+        Returns the number of entries removed.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        removed = 0
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+def absolute_events(track):
+    """
+    Yields (absolute_time, msg) for every message in track, converting delta times in a single walk.
+    """
+    abs_time = 0
+    for msg in track:
+        abs_time += msg.time
+        yield abs_time, msg
 
-    for i in range(len(beat_times) - 1):
-        phrase_start = beat_times[i]
-        phrase_end = beat_times[i + 1]
+# Step 1.5: Remove overlapping notes in 'PART VOCALS' track
+def remove_overlapping_notes(events, note_range, report):
+    """
+    Drops notes within note_range that start at the same time as an earlier note in the range,
+    together with their note_off. Streams (absolute_time, msg) pairs, so removed events never
+    shift the timing of the events around them.
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
+    last_note_on_time = None
+    removed_notes = set()  # Track notes removed so their corresponding note_off can also be removed
+
+    for abs_time, msg in events:
+        if msg.type in ('note_on', 'note_off') and msg.note in note_range:
+            if msg.type == 'note_on' and msg.velocity > 0:
+                # Events arrive in time order, so an overlap always shares the previous note_on time
+                if abs_time == last_note_on_time:
+                    removed_notes.add(msg.note)
+                    report['overlaps_removed'] += 1
+                    if debug:
+                        logger.debug("Removing subsequent note_on: Note %d at time %d", msg.note, abs_time)
+                    continue
+                last_note_on_time = abs_time
+            elif msg.note in removed_notes:
+                # Only remove note_off if its corresponding note_on was removed
+                removed_notes.discard(msg.note)
+                if debug:
+                    logger.debug("Removing note_off: Note %d at time %d", msg.note, abs_time)
+                continue
+        yield abs_time, msg
+
+def shift_pad_notes(events, lanes=(PAD_LANES['expert'],)):
+    """
+    Moves the notes of every pad lane in lanes (e.g. 96-100 for Expert) onto the pitched window (78-82).
+    Yields (absolute_time, msg, lane_index, pitch) where pitch is the shifted note, or lane_index and pitch
+    are None for non-note events. Notes outside the lanes and the original track_name are dropped,
+    other events are carried over.
+    """
+    lane_of = {lane + offset: index for index, lane in enumerate(lanes) for offset in range(LANE_WIDTH)}
+    for abs_time, msg in events:
+        if msg.type in ('note_on', 'note_off'):
+            index = lane_of.get(msg.note)
+            if index is not None:
+                yield abs_time, msg, index, msg.note - lanes[index] + PITCHED_LANE
+        elif msg.type != 'track_name':
+            yield abs_time, msg, None, None
+
+def pair_vocal_notes(notes):
+    """
+    Pairs note_on/note_off events FIFO per pitch in one batch and returns (intervals, warnings).
+    Events are grouped by pitch, then matched in time order against a deque of open note_on times.
+    intervals is sorted by start; warnings lists every unmatched event as a dict.
+    """
+    times, pitches = notes.times, notes.pitches
+    # sorted() is stable, so each pitch group stays in time order
+    order = sorted(range(len(notes)), key=pitches.__getitem__)
+
+    pairs = []  # (start, note_off index, end, pitch)
+    warnings = []
+    open_starts = deque()
+    current_pitch = None
+
+    def flush_unmatched():
+        # Any note_on still open when its pitch group ends has no matching note_off
+        warnings.extend({'type': 'unmatched_note_on', 'note': current_pitch, 'time': start_time}
+                        for start_time in open_starts)
+        open_starts.clear()
+
+    for index in order:
+        pitch = pitches[index]
+        if pitch != current_pitch:
+            flush_unmatched()
+            current_pitch = pitch
+        if notes.is_note_on(index):
+            open_starts.append(times[index])
+        elif open_starts:
+            pairs.append((open_starts.popleft(), index, times[index], pitch))
+        else:
+            warnings.append({'type': 'unmatched_note_off', 'note': pitch, 'time': times[index]})
+    flush_unmatched()
 
-        # Ensure this phrase starts after the previous one
-        if previous_phrase_end is not None and phrase_start <= previous_phrase_end:
-            # Adjust the start time of the current phrase to ensure no overlap
-            phrase_start = previous_phrase_end
-            print(f"Adjusting phrase start to {phrase_start} to avoid overlap with previous phrase ending at {previous_phrase_end}")
+    # Order by start, breaking ties by note_off position like sequential pairing would
+    pairs.sort()
+    warnings.sort(key=lambda warning: (warning['time'], warning['note']))
+    starts, _, ends, pair_pitches = zip(*pairs) if pairs else ((), (), (), ())
+    return NoteIntervals(starts, ends, pair_pitches), warnings
 
-        # Collect notes that start within this phrase
-        notes_in_phrase = []
-        while note_index < total_notes and intervals_sorted[note_index]['start'] < phrase_end:
-            if intervals_sorted[note_index]['start'] >= phrase_start:
-                notes_in_phrase.append(intervals_sorted[note_index])
-            note_index += 1
+def merge_intervals(lane_intervals):
+    """
+    Merges the intervals of several lanes, each sorted by start, into one NoteIntervals sorted by start.
+    """
+    if len(lane_intervals) == 1:
+        return lane_intervals[0]
+    merged = list(heapq.merge(*(zip(intervals.starts, intervals.ends, intervals.pitches)
+                                for intervals in lane_intervals), key=itemgetter(0)))
+    starts, ends, pitches = zip(*merged) if merged else ((), (), ())
+    return NoteIntervals(starts, ends, pitches)
+
+def phrases_with_notes(phrases, intervals):
+    """
+    Returns the phrases that hold at least one of the intervals from start to end, so a note starting
+    where the previous phrase ends doesn't keep that phrase.
+    """
+    return [phrase for phrase in phrases if notes_within(intervals, phrase[0], phrase[1])]
 
-        if not notes_in_phrase:
-            continue  # No notes in this phrase
+def notes_within(intervals, phrase_start, phrase_end):
+    """
+    Returns the indices of the intervals that start and end inside [phrase_start, phrase_end].
+    intervals must be sorted by start; its starts array doubles as the bisect index.
+    """
+    lo = bisect_left(intervals.starts, phrase_start)
+    hi = bisect_right(intervals.starts, phrase_end)
+    ends = intervals.ends
+    return [i for i in range(lo, hi) if ends[i] <= phrase_end]
 
-        # Determine the actual start and end of the phrase based on notes
-        actual_start = min(note['start'] for note in notes_in_phrase)
-        actual_end = max(note['end'] for note in notes_in_phrase)
-
-        # Ensure the phrase meets the minimum length
-        phrase_length = actual_end - actual_start
-        if phrase_length < MIN_PHRASE_LENGTH:
-            # Attempt to include notes from the next phrase
-            if i + 1 < len(beat_times) - 1:
-                next_phrase_start = beat_times[i + 1]
-                next_phrase_end = beat_times[i + 2] if i + 2 < len(beat_times) else beat_times[-1] + (beat_times[-1] - beat_times[-2] if len(beat_times) >= 2 else MIN_PHRASE_LENGTH)
-
-                # Collect notes from the next phrase that might be within the gap threshold
-                temp_notes = []
-                temp_index = note_index
-                while temp_index < total_notes and intervals_sorted[temp_index]['start'] < next_phrase_end:
-                    if (intervals_sorted[temp_index]['start'] - actual_end) <= PHRASE_GAP_THRESHOLD:
-                        temp_notes.append(intervals_sorted[temp_index])
-                        actual_end = max(actual_end, intervals_sorted[temp_index]['end'])
-                        phrase_length = actual_end - actual_start
-                    else:
-                        break
-                    temp_index += 1
+@contextmanager
+def run_stage(name, report, hooks=(), trace_memory=False):
+    """
+    Wraps one named pipeline stage. Yields a record the stage stores its event count in, then adds
+    the wall time (and the tracemalloc peak when trace_memory is set), saves the record as
+    report['stages'][name] and passes it to every instrumentation hook as hook(name, record).
+    """
+    record = {'elapsed': 0.0, 'events': 0}
+    if trace_memory:
+        import tracemalloc
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['elapsed'] = round(time.perf_counter() - started, 6)
+        if trace_memory:
+            record['peak_bytes'] = tracemalloc.get_traced_memory()[1] - memory_before
+        report['stages'][name] = record
+        for hook in hooks:
+            hook(name, record)
+
+# Step 1: Identify BEAT track and collect down beat times
+def scan_beats(beat_chunk):
+    """
+    Returns the sorted absolute times of the down beats (note 12) in the BEAT track.
+    """
+    beat_times = [abs_time for abs_time, msg in absolute_events(decode_track(beat_chunk))
+                  if msg.type == 'note_on' and msg.note == 12 and msg.velocity > 0]
+    # Sort beat_times to ensure they are in ascending order
+    return sorted(beat_times)
 
-                # If after adding the next phrase's notes, it meets the minimum length, create a combined phrase
-                if phrase_length >= MIN_PHRASE_LENGTH:
-                    phrases.append([actual_start, actual_end])
-                    note_index = temp_index  # Skip ahead
-                else:
-                    # Still not enough, assign as is
-                    phrases.append([actual_start, actual_end])
+# Step 2: Stream PART VOCALS through overlap removal and the pitch shift in one walk
+def collect_vocals(vocal_chunks, report, lanes=(PAD_LANES['expert'],)):
+    """
+    Decodes the PART VOCALS chunks once and returns (lane_notes, other_events): a VocalNotes of
+    shifted notes for every pad lane in lanes and the carried over non-note events as
+    (absolute_time, msg) pairs.
+    """
+    other_events = []
+    lane_notes = [VocalNotes() for _ in lanes]
+    for chunk in vocal_chunks:
+        events = absolute_events(decode_track(chunk))
+        for lane in lanes:
+            events = remove_overlapping_notes(events, range(lane, lane + LANE_WIDTH), report)
+        for total_time, msg, lane_index, pitch in shift_pad_notes(events, lanes):
+            if pitch is None:
+                other_events.append((total_time, msg))
             else:
-                # Last phrase, assign as is
-                phrases.append([actual_start, actual_end])
+                lane_notes[lane_index].append(total_time, msg, pitch)
+    return lane_notes, other_events
+
+# Step 4: Define phrases based on beat_times and assign notes to phrases
+def build_phrases(beat_times, intervals):
+    """
+    Groups the syllables into [start_time, end_time] phrases in one sweep over the syllables and the
+    sorted down beats. A phrase is closed before a syllable that starts in a later bar once it is at
+    least MIN_PHRASE_LENGTH long and every syllable in it has ended at least PHRASE_GAP_THRESHOLD
+    ticks earlier, so legato lines still split at bar lines. The last phrase is padded to
+    MIN_PHRASE_LENGTH, so the phrases never overlap (they may touch), cover every syllable and all
+    meet the minimum length.
+    """
+    starts, ends = intervals.starts, intervals.ends
+    if not len(intervals):
+        return []
+
+    phrases = []  # List of [start_time, end_time]
+    beat_count = len(beat_times)
+    bar = 0  # Number of down beats at or before the previous syllable
+    phrase_start, phrase_end = starts[0], ends[0]
+    while bar < beat_count and beat_times[bar] <= phrase_start:
+        bar += 1
+
+    for note_index in range(1, len(intervals)):
+        note_start = starts[note_index]
+        previous_bar = bar
+        while bar < beat_count and beat_times[bar] <= note_start:
+            bar += 1
+
+        if (bar > previous_bar and phrase_end - phrase_start >= MIN_PHRASE_LENGTH
+                and note_start - phrase_end >= PHRASE_GAP_THRESHOLD):
+            phrases.append([phrase_start, phrase_end])
+            phrase_start, phrase_end = note_start, ends[note_index]
         else:
-            phrases.append([actual_start, actual_end])
+            phrase_end = max(phrase_end, ends[note_index])
 
-        # Update previous_phrase_end to ensure the next phrase starts after this one
-        previous_phrase_end = actual_end
+    phrases.append([phrase_start, max(phrase_end, phrase_start + MIN_PHRASE_LENGTH)])
+    return phrases
 
-    # Handle any remaining notes not assigned to any phrase
-    while note_index < total_notes:
-        note = intervals_sorted[note_index]
-        if not phrases:
-            phrases.append([note['start'], note['end']])
+def validate_phrases(phrases, intervals):
+    """
+    Checks the phrases against the rules Magma enforces in a single linear pass and returns a list of
+    problems as dicts: overlapping phrases, phrases without notes and notes not inside any phrase.
+    Both phrases and intervals must be sorted by start time.
+    """
+    problems = []
+    starts, ends = intervals.starts, intervals.ends
+    note_counts = [0] * len(phrases)
+
+    previous_end = None
+    for phrase_start, phrase_end in phrases:
+        if previous_end is not None and phrase_start < previous_end:
+            problems.append({'type': 'phrase_overlap', 'time': phrase_start, 'previous_end': previous_end})
+        previous_end = phrase_end if previous_end is None else max(previous_end, phrase_end)
+
+    phrase_index = 0
+    for note_index in range(len(intervals)):
+        note_start, note_end = starts[note_index], ends[note_index]
+        # Skip phrases that end before this note starts, later notes can't be in them either.
+        # A phrase ending where the note starts only holds it if the note has no length.
+        while phrase_index < len(phrases) and (phrases[phrase_index][1] < note_start or
+                                               phrases[phrase_index][1] == note_start < note_end):
+            phrase_index += 1
+        if (phrase_index < len(phrases) and phrases[phrase_index][0] <= note_start
+                and note_end <= phrases[phrase_index][1]):
+            note_counts[phrase_index] += 1
         else:
-            last_phrase = phrases[-1]
-            gap = note['start'] - last_phrase[1]
-            if gap <= PHRASE_GAP_THRESHOLD:
-                # Extend the last phrase to include this note
-                print(f"Extending last phrase from {last_phrase[0]}-{last_phrase[1]} to include {note['start']}-{note['end']}")
-                last_phrase[1] = max(last_phrase[1], note['end'])
-            else:
-                # Start a new phrase
-                phrases.append([note['start'], note['end']])
-        note_index += 1
+            problems.append({'type': 'note_outside_phrase', 'time': note_start, 'end': note_end})
 
-    # Sort and remove duplicate phrases
-    phrases = sorted(set(tuple(p) for p in phrases))
-    phrases = [list(p) for p in phrases]
+    for (phrase_start, phrase_end), count in zip(phrases, note_counts):
+        if not count:
+            problems.append({'type': 'empty_phrase', 'time': phrase_start, 'end': phrase_end})
 
-    # Step 5: Assign text events based on notes within phrases
-    for phrase in phrases:
-        phrase_start, phrase_end = phrase
+    problems.sort(key=lambda problem: problem['time'])
+    return problems
+
+def assign_lyrics(intervals, phrases, words):
+    """
+    Assigns a lyric to every syllable inside a phrase (Steps 5-7) and returns {start_time: text}.
+    Long notes alternate between a word and '+' slides, and no phrase starts with '+'.
+    Words are taken in order from the words iterator (see lyric_words).
+    """
+    debug = logger.isEnabledFor(logging.DEBUG)
+    next_word = words.__next__
+    starts, ends, kinds = intervals.starts, intervals.ends, intervals.kinds
+    text_events = {}
 
-        # Find notes within this phrase
-        notes_in_phrase = [
-            interval for interval in intervals_sorted
-            if interval['start'] >= phrase_start and interval['end'] <= phrase_end
-        ]
+    # Step 5: Assign text events based on notes within phrases
+    # Index the notes once by start time so each phrase lookup is a bisect instead of a full scan
+    phrase_notes = [notes_within(intervals, phrase_start, phrase_end)
+                    for phrase_start, phrase_end in phrases]
 
+    for notes_in_phrase in phrase_notes:
         if not notes_in_phrase:
             continue  # No notes in this phrase
 
-        # Sort notes by start time
-        notes_in_phrase_sorted = sorted(notes_in_phrase, key=lambda x: x['start'])
-
         # Initialize tracking to alternate between word and '+'
         assign_word_next = True  # This will toggle between word and '+'
         last_note_end_time = None  # Track the last note's end time
 
-        for note in notes_in_phrase_sorted:
-            syllable_start = note['start']
-            syllable_type = note['type']
+        for note in notes_in_phrase:
+            syllable_start = starts[note]
+            syllable_type = kinds[note]
 
             # Check for a significant gap before assigning (always assign word after long gap)
             if last_note_end_time is not None and (syllable_start - last_note_end_time) > GAP_THRESHOLD:
                 assign_word_next = True  # Reset to ensure word assignment after a gap
 
-            if syllable_type == 'long':
+            if syllable_type == LONG:
                 if assign_word_next:
                     # Assign a word to this long note
-                    random_word = random.choice(mouth_movement_words)
                     if syllable_start not in text_events:
-                        text_events[syllable_start] = random_word
+                        text_events[syllable_start] = next_word()
                 else:
                     # Assign '+' to the next long note
                     if syllable_start not in text_events:
@@ -371,115 +786,821 @@ def process_midi_file(midi_path):
                 assign_word_next = not assign_word_next
             else:
                 # For short and medium notes, always assign a word
-                random_word = random.choice(mouth_movement_words)
                 if syllable_start not in text_events:
-                    text_events[syllable_start] = random_word
+                    text_events[syllable_start] = next_word()
 
             # Update the last_note_end_time for gap tracking
-            last_note_end_time = note['end']
+            last_note_end_time = ends[note]
 
     # Step 6: Ensure no phrase starts with '+'
-    phrases_sorted = sorted(phrases, key=lambda x: x[0])
     text_events_sorted = sorted(text_events.items(), key=lambda x: x[0])
+    text_event_times = [te[0] for te in text_events_sorted]
 
-    for phrase in phrases_sorted:
-        phrase_start, _ = phrase
+    for phrase_start, _ in phrases:
         # Find the first text event in the phrase
-        first_text_event = next((te for te in text_events_sorted if te[0] >= phrase_start), None)
+        index = bisect_left(text_event_times, phrase_start)
+        first_text_event = text_events_sorted[index] if index < len(text_events_sorted) else None
         if first_text_event and first_text_event[1] == '+':
             # Replace '+' with a random word
-            new_word = random.choice(mouth_movement_words)
+            new_word = next_word()
             text_events[first_text_event[0]] = new_word
             #print(f"Replaced '+' with '{new_word}' at time {first_text_event[0]} in phrase starting at {phrase_start}")
 
     # Step 7: Assign default lyrics to any missing vocal notes
-    for phrase in phrases_sorted:
-        phrase_start, phrase_end = phrase
-        # Find notes within this phrase
-        notes_in_phrase = [
-            interval for interval in intervals_sorted
-            if interval['start'] >= phrase_start and interval['end'] <= phrase_end
-        ]
+    for notes_in_phrase in phrase_notes:
         for note in notes_in_phrase:
-            syllable_start = note['start']
-            syllable_type = note['type']
+            syllable_start = starts[note]
+            syllable_type = kinds[note]
             if syllable_start not in text_events:
-                if syllable_type == 'short':
+                if syllable_type == SHORT:
                     # Assign a random word
-                    default_word = random.choice(mouth_movement_words)
+                    default_word = next_word()
                     text_events[syllable_start] = default_word
-                    print(f"Assigned default word '{default_word}' to short syllable at time {syllable_start}")
-                elif syllable_type == 'long':
+                    if debug:
+                        logger.debug("Assigned default word '%s' to short syllable at time %d", default_word, syllable_start)
+                elif syllable_type == LONG:
                     # Assign '+' to long syllables if not already assigned
                     text_events[syllable_start] = '+'
-                    print(f"Assigned '+' to long syllable at time {syllable_start}")
+                    if debug:
+                        logger.debug("Assigned '+' to long syllable at time %d", syllable_start)
                 else:
                     # Assign a random word for medium syllables
-                    default_word = random.choice(mouth_movement_words)
+                    default_word = next_word()
                     text_events[syllable_start] = default_word
-                    print(f"Assigned default word '{default_word}' to medium syllable at time {syllable_start}")
-
-    # Step 8: Merge all text events into messages_with_abs_time
-    for abs_time, text in text_events.items():
-        text_event = MetaMessage('text', text=text, time=0)
-        messages_with_abs_time.append((abs_time, text_event))
-
-    # Step 9: Create phrase indicator messages (note_on and note_off for note 105)
-    for ps, pe in phrases_sorted:
-        ps = int(ps)
-        pe = int(pe)
-        note_on_msg = Message('note_on', note=105, velocity=127, time=0)
-        note_off_msg = Message('note_off', note=105, velocity=0, time=0)
-        messages_with_abs_time.append((ps, note_on_msg))
-        messages_with_abs_time.append((pe, note_off_msg))
-
-    # Step 10: Sort all messages by absolute time and event type
-    def event_sort_order(msg):
-        if msg.type == 'note_off':
-            return 0
-        elif msg.type == 'note_on':
-            return 1
-        elif msg.type == 'text':
-            return 2
-        else:
-            return 3  # Other messages
+                    if debug:
+                        logger.debug("Assigned default word '%s' to medium syllable at time %d", default_word, syllable_start)
 
-    messages_with_abs_time.sort(key=lambda x: (x[0], event_sort_order(x[1])))
+    return text_events
+
+def in_time_order(times):
+    """
+    Returns the indices of times in ascending time order, keeping the order of equal times.
+    A single pass suffices when times are already sorted, which is the case unless a chart has
+    several PART VOCALS tracks.
+    """
+    if all(previous <= current for previous, current in zip(times, times[1:])):
+        return range(len(times))
+    return sorted(range(len(times)), key=times.__getitem__)
 
-    # Step 11: Convert absolute times back to delta times
+def assemble_vocals_track(notes, other_events, text_events, phrases, report, name='PART VOCALS'):
+    """
+    Builds a new vocals MidiTrack called name from the notes, carried over events, lyrics and phrase
+    markers (Steps 8-11). Negative delta times are clamped to 0 and counted in report.
+    """
+    from mido import MidiTrack, MetaMessage, Message
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    # Step 8: Turn every source into a time ordered stream of (sort_key, stream, index). The sort key packs
+    # the absolute time and the rank of the event type at that time into one integer (see EVENT_RANK_BITS),
+    # and the stream number keeps the notes ahead of the carried over events, lyrics and phrase markers at
+    # equal keys, like the stable sort this replaces.
+    times, pitches, velocities, channels, types = notes.times, notes.pitches, notes.velocities, notes.channels, notes.types
+    note_order = in_time_order(times)
+    note_offs = ((times[i] << EVENT_RANK_BITS | NOTE_OFF_RANK, NOTE_OFF_STREAM, i) for i in note_order if not types[i])
+    note_ons = ((times[i] << EVENT_RANK_BITS | NOTE_ON_RANK, NOTE_ON_STREAM, i) for i in note_order if types[i])
+
+    other_order = in_time_order([abs_time for abs_time, _ in other_events])
+    other_texts = ((other_events[i][0] << EVENT_RANK_BITS | TEXT_RANK, OTHER_TEXT_STREAM, i)
+                   for i in other_order if other_events[i][1].type == 'text')
+    other_rest = ((other_events[i][0] << EVENT_RANK_BITS | OTHER_RANK, OTHER_STREAM, i)
+                  for i in other_order if other_events[i][1].type != 'text')
+
+    lyrics = sorted(text_events.items())
+    lyric_stream = ((abs_time << EVENT_RANK_BITS | TEXT_RANK, LYRIC_STREAM, i) for i, (abs_time, _) in enumerate(lyrics))
+
+    # Step 9: Phrase indicator messages (note_on and note_off for note 105). Phrases are sorted and don't
+    # overlap, so their ends are in order as well.
+    phrase_ons = ((int(ps) << EVENT_RANK_BITS | NOTE_ON_RANK, PHRASE_ON_STREAM, 105) for ps, _ in phrases)
+    phrase_offs = ((int(pe) << EVENT_RANK_BITS | NOTE_OFF_RANK, PHRASE_OFF_STREAM, 105) for _, pe in phrases)
+
+    # Step 10: Merge the streams by absolute time and event type
+    merged = heapq.merge(note_offs, note_ons, other_texts, other_rest, lyric_stream, phrase_ons, phrase_offs)
+
+    # Step 11: Write every event straight into the new track with its delta time
+    new_track = MidiTrack()
+    new_track.append(MetaMessage('track_name', name=name, time=0))
+    new_track.append(MetaMessage('sequencer_specific', data=CONVERTED_MARKER, time=0))
+    append = new_track.append
     previous_time = 0
-    for abs_time, msg in messages_with_abs_time:
-        abs_time = int(abs_time)
+    for sort_key, stream, index in merged:
+        abs_time = sort_key >> EVENT_RANK_BITS
         delta_time = abs_time - previous_time
         if delta_time < 0:
-            print(f"Warning: Negative delta_time encountered at time {abs_time}. Setting delta_time to 0.")
+            report['negative_deltas'] += 1
+            if debug:
+                logger.debug("Negative delta_time encountered at time %d. Setting delta_time to 0.", abs_time)
             delta_time = 0
-        msg.time = delta_time
-        new_track.append(msg)
+        if stream <= NOTE_ON_STREAM:
+            append(Message('note_on' if types[index] else 'note_off', note=pitches[index],
+                           velocity=velocities[index], channel=channels[index], time=delta_time))
+        elif stream == LYRIC_STREAM:
+            append(MetaMessage('text', text=lyrics[index][1], time=delta_time))
+        elif stream == PHRASE_ON_STREAM:
+            append(Message('note_on', note=index, velocity=127, time=delta_time))
+        elif stream == PHRASE_OFF_STREAM:
+            append(Message('note_off', note=index, velocity=0, time=delta_time))
+        else:
+            msg = other_events[index][1]
+            msg.time = delta_time
+            append(msg)
         previous_time = abs_time
+    return new_track
+
+def check_output(midi_path, vocal_chunks, report, stage):
+    """
+    Runs the validator over the generated vocal chunks as the 'validate' stage and adds its diagnostics
+    to report.
+    """
+    with stage('validate') as record:
+        diagnostics = validate_vocals_chunks(vocal_chunks)
+        record['events'] = len(diagnostics)
+    report['diagnostics'].extend(diagnostics)
+    report['warnings'] += len(diagnostics)
+    if diagnostics:
+        logger.warning("%s: %d problems Magma would reject in the generated tracks", midi_path, len(diagnostics))
+        for diagnostic in diagnostics:
+            logger.debug("%s: %s at time %d", diagnostic['track'], diagnostic['type'], diagnostic['time'])
+
+def output_is_current(midi_path, output_path):
+    """
+    Tells whether output_path is a separate, already converted file that is newer than midi_path.
+    """
+    return (output_path != midi_path and os.path.exists(output_path)
+            and os.path.getmtime(output_path) >= os.path.getmtime(midi_path) and is_converted_file(output_path))
+
+# Step 14: Check the generated tracks against the Magma rules
+def validate_vocals_track(chunk):
+    """
+    Checks a vocals MTrk chunk against the rules Magma enforces in a single pass over its raw events and
+    returns a list of diagnostics, each a dict with a type and a time: phrase_overlap, lyric_outside_phrase,
+    phrase_starts_with_slide, note_out_of_range, unmatched_note_on and unmatched_note_off.
+    Bracketed text events such as [idle] are not lyrics.
+    """
+    diagnostics = []
+    open_notes = {}  # pitch -> deque of the start times of its open note_ons
+    open_phrases = 0
+    first_lyric_pending = False  # True until the first lyric of the open phrase is seen
+
+    for abs_time, status, meta_type, data in raw_events(chunk):
+        if meta_type is not None:
+            if meta_type in (0x01, 0x05):
+                text = bytes(data).decode('latin1')
+                if text.startswith('['):
+                    continue
+                if not open_phrases:
+                    diagnostics.append({'type': 'lyric_outside_phrase', 'time': abs_time, 'text': text})
+                elif first_lyric_pending:
+                    first_lyric_pending = False
+                    if text.startswith('+'):
+                        diagnostics.append({'type': 'phrase_starts_with_slide', 'time': abs_time})
+            continue
+
+        kind = status & 0xf0
+        if kind == 0x90 and data[1] > 0:
+            note = data[0]
+            if note in PHRASE_NOTES:
+                if open_phrases:
+                    diagnostics.append({'type': 'phrase_overlap', 'time': abs_time})
+                open_phrases += 1
+                first_lyric_pending = True
+            elif note not in PITCHED_RANGE and note not in VOCAL_CONTROL_NOTES:
+                diagnostics.append({'type': 'note_out_of_range', 'time': abs_time, 'note': note})
+            open_notes.setdefault(note, deque()).append(abs_time)
+        elif kind in (0x80, 0x90):
+            note = data[0]
+            starts = open_notes.get(note)
+            if starts:
+                starts.popleft()
+                if note in PHRASE_NOTES:
+                    open_phrases -= 1
+            else:
+                diagnostics.append({'type': 'unmatched_note_off', 'time': abs_time, 'note': note})
+
+    for note, starts in open_notes.items():
+        diagnostics.extend({'type': 'unmatched_note_on', 'time': start, 'note': note} for start in starts)
+    diagnostics.sort(key=lambda diagnostic: diagnostic['time'])
+    return diagnostics
+
+def validate_vocals_chunks(chunks):
+    """
+    Runs validate_vocals_track over every vocals track in chunks and returns all diagnostics,
+    each tagged with the name of its track.
+    """
+    diagnostics = []
+    for chunk in chunks:
+        name = scan_track_name(chunk)
+        if name is not None and name.upper() in VOCAL_TRACK_NAMES:
+            diagnostics.extend({'track': name, **diagnostic} for diagnostic in validate_vocals_track(chunk))
+    return diagnostics
+
+def process_midi_file(midi_path, cache=None, output_path=None, report=None, hooks=(), trace_memory=False,
+                      seed=DEFAULT_SEED, output_lanes=DEFAULT_OUTPUT_LANES, data=None, write=write_midi_chunks):
+    """
+    Converts the pad vocals of midi_path and writes the result to output_path (default: in place).
+    output_lanes lists the (track name, pad lane) of every generated track. All of them are built from
+    one parse and share the beat scan, the pairing of each lane and the phrases; existing tracks with
+    the same names are replaced. data optionally holds the already read bytes of midi_path, and the
+    result is saved with write(output_path, file_type, division, chunks). The generated tracks are then
+    checked with validate_vocals_track and the diagnostics are stored in report['diagnostics'].
+    Returns 'ok', 'cached' when the generated track came from cache, 'already' when the input or an
+    up to date output is already lazy-lip output, or 'skipped' when there are no BEAT down beats.
+    If given, report is filled with counts and a record per stage (see run_stage), and every hook
+    is called as hook(stage_name, record) when a stage finishes. trace_memory adds the tracemalloc
+    peak of each stage and requires tracemalloc to be tracing. Lyrics are drawn from a generator seeded
+    with seed and the source PART VOCALS bytes, so the output is reproducible.
+    """
+    report = {} if report is None else report
+    report.update(overlaps_removed=0, phrases=0, lyrics=0, slides=0, warnings=0, negative_deltas=0, diagnostics=[],
+                  stages={})
+    stage = partial(run_stage, report=report, hooks=hooks, trace_memory=trace_memory)
+
+    output_path = output_path or midi_path
+    if output_is_current(midi_path, output_path):
+        logger.info("Skipped %s, %s is already converted", midi_path, output_path)
+        return 'already'
+
+    logger.debug("Processing %s", midi_path)
+    with stage('read') as record:
+        if data is None:
+            with open(midi_path, 'rb') as infile:
+                data = infile.read()
+        file_type, division, chunks = read_midi_chunks(data)
+        vocal_indices, beat_index = find_source_tracks(chunks)
+        output_names = {name.upper() for name, _ in output_lanes}
+        replaced_indices = set(vocal_indices)
+        replaced_indices.update(i for i, chunk in enumerate(chunks) if (scan_track_name(chunk) or '').upper() in output_names)
+        record['events'] = len(chunks)
+
+    if any(is_converted_track(chunks[i]) for i in vocal_indices):
+        logger.info("Skipped %s, PART VOCALS is already converted", midi_path)
+        return 'already'
+
+    # A cache hit splices the stored track in without running Steps 1-11
+    key = None
+    if cache is not None and beat_index is not None:
+        key = cache_key(chunks[beat_index], [chunks[i] for i in vocal_indices], seed, output_lanes)
+        cached_chunks = cache.get(key)
+        if cached_chunks is not None:
+            with stage('write') as record:
+                chunks = [chunk for i, chunk in enumerate(chunks) if i not in replaced_indices]
+                chunks.extend(cached_chunks)
+                write(output_path, file_type, division, chunks)
+                record['events'] = len(chunks)
+            check_output(midi_path, cached_chunks, report, stage)
+            logger.info("Finished %s (cached)", midi_path)
+            return 'cached'
+
+    # Load mido outside the timed stages, so the first conversion in a process doesn't charge the
+    # import to beat_scan. Skipped and cached files return above without it.
+    import mido
+
+    with stage('beat_scan') as record:
+        beat_times = scan_beats(chunks[beat_index]) if beat_index is not None else []
+        record['events'] = len(beat_times)
+
+    if not beat_times:
+        logger.info("Skipped %s, no down beats (note 12) found in BEAT track. Cannot determine phrases.", midi_path)
+        return 'skipped'
 
-    # Step 12: Replace the existing PART VOCALS track with the new one
-    mid.tracks = [track for track in mid.tracks if 'PART VOCALS' not in track.name.upper()]
-    mid.tracks.append(new_track)
+    # Tracks built from the same lane share its notes, pairing and lyrics
+    lanes = list(dict.fromkeys(lane for _, lane in output_lanes))
+    vocal_chunks = [chunks[i] for i in vocal_indices]
+    with stage('vocals') as record:
+        lane_notes, other_events = collect_vocals(vocal_chunks, report, lanes)
+        record['events'] = sum(map(len, lane_notes)) + len(other_events)
 
+    # Step 3: Identify syllables from long and short notes
+    with stage('pairing') as record:
+        lane_intervals = []
+        pairing_warnings = []
+        for notes in lane_notes:
+            intervals, warnings = pair_vocal_notes(notes)
+            lane_intervals.append(intervals)
+            pairing_warnings.extend(warnings)
+        record['events'] = sum(map(len, lane_intervals))
+
+    report['warnings'] += len(pairing_warnings)
+    if pairing_warnings:
+        logger.warning("%s: %d unmatched note events in PART VOCALS track", midi_path, len(pairing_warnings))
+        for warning in pairing_warnings:
+            logger.debug("Unmatched %s for note %d at time %d", warning['type'][10:], warning['note'], warning['time'])
+    if not any(lane_intervals):
+        logger.warning("%s: no note events found in PART VOCALS track", midi_path)
+
+    # Phrases are built once over the notes of every lane, so the tracks share their phrase boundaries.
+    # Each track then keeps the phrases its own notes fall in.
+    with stage('phrases') as record:
+        phrases = build_phrases(beat_times, merge_intervals(lane_intervals))
+        lane_phrases = [phrases if len(lanes) == 1 else phrases_with_notes(phrases, intervals)
+                        for intervals in lane_intervals]
+        phrase_problems = []
+        for lane, intervals, phrases_of_lane in zip(lanes, lane_intervals, lane_phrases):
+            track = next(name for name, track_lane in output_lanes if track_lane == lane)
+            phrase_problems.extend({'track': track, **problem} for problem in validate_phrases(phrases_of_lane, intervals))
+        record['events'] = len(phrases)
+
+    report['diagnostics'].extend(phrase_problems)
+    report['warnings'] += len(phrase_problems)
+    if phrase_problems:
+        logger.warning("%s: %d phrase problems Magma would reject", midi_path, len(phrase_problems))
+        for problem in phrase_problems:
+            logger.debug("%s: phrase problem %s at time %d", problem['track'], problem['type'], problem['time'])
+
+    with stage('lyrics') as record:
+        lane_text_events = [assign_lyrics(intervals, phrases_of_lane, lyric_words(lyric_seed(vocal_chunks, seed, lane)))
+                            for lane, intervals, phrases_of_lane in zip(lanes, lane_intervals, lane_phrases)]
+        record['events'] = sum(map(len, lane_text_events))
+
+    # The carried over events stay with the first track, which is PART VOCALS unless configured otherwise
+    with stage('assemble') as record:
+        new_tracks = []
+        for name, lane in output_lanes:
+            index = lanes.index(lane)
+            new_tracks.append(assemble_vocals_track(lane_notes[index], other_events if not new_tracks else [],
+                                                    lane_text_events[index], lane_phrases[index], report, name))
+        record['events'] = sum(map(len, new_tracks))
+
+    if report['negative_deltas']:
+        report['warnings'] += report['negative_deltas']
+        report['diagnostics'].append({'type': 'negative_delta_fixups', 'count': report['negative_deltas']})
+        logger.warning("%s: %d negative delta times were set to 0", midi_path, report['negative_deltas'])
+
+    # Step 12: Replace the existing PART VOCALS track with the new ones, other tracks are copied byte for byte
     # Step 13: Save the modified MIDI file
-    mid.save(midi_path)
-    print(f"Finished processing {midi_path}")
+    with stage('write') as record:
+        vocal_chunks = [encode_track(track) for track in new_tracks]
+        chunks = [chunk for i, chunk in enumerate(chunks) if i not in replaced_indices]
+        chunks.extend(vocal_chunks)
+        write(output_path, file_type, division, chunks)
+        if key is not None:
+            cache.put(key, vocal_chunks)
+        record['events'] = len(chunks)
+    check_output(midi_path, vocal_chunks, report, stage)
+
+    track_text_events = [lane_text_events[lanes.index(lane)] for _, lane in output_lanes]
+    report['phrases'] = len(phrases)
+    report['lyrics'] = sum(map(len, track_text_events))
+    report['slides'] = sum(1 for text_events in track_text_events for text in text_events.values() if text == '+')
+    logger.info("Finished %s: %d phrases, %d lyrics, %d slides, %d overlaps removed, %d warnings in %.3fs",
+                midi_path, report['phrases'], report['lyrics'], report['slides'], report['overlaps_removed'],
+                report['warnings'], sum(stage_record['elapsed'] for stage_record in report['stages'].values()))
+    return 'ok'
+
+def find_midi_files(paths, pattern='*.mid'):
+    """
+    Expands files, song folders and glob patterns into a sorted list of (midi_path, relative_path).
+    relative_path is used to mirror the pack layout in --out-dir: files found in a folder keep the
+    folder's name and their location below it, plain files keep the name of their parent folder
+    (song folders all hold a notes.mid) and glob matches are taken below the glob base.
+    Folders are searched recursively for file names matching pattern (case-insensitive).
+    """
+    found = {}
+    for path in paths:
+        if os.path.isdir(path):
+            parent = os.path.dirname(os.path.abspath(path))
+            for root, _, files in os.walk(path):
+                for name in files:
+                    if fnmatch.fnmatch(name.lower(), pattern.lower()):
+                        midi_path = os.path.join(root, name)
+                        found.setdefault(midi_path, os.path.relpath(os.path.abspath(midi_path), parent))
+        elif any(c in path for c in '*?['):
+            base = path
+            while any(c in base for c in '*?['):
+                base = os.path.dirname(base)
+            for midi_path in glob.glob(path, recursive=True):
+                if os.path.isfile(midi_path):
+                    found.setdefault(midi_path, os.path.relpath(midi_path, base or '.'))
+        else:
+            folder = os.path.basename(os.path.dirname(os.path.abspath(path)))
+            found.setdefault(path, os.path.join(folder, os.path.basename(path)))
+    return sorted(found.items())
 
-def main(midi_path):
-    if not os.path.isfile(midi_path):
-        print(f"Error: The file '{midi_path}' does not exist.")
-        sys.exit(1)
+def profile_path(profile_dir, midi_path):
+    """
+    Names the pstats file of midi_path inside profile_dir after its full path, so songs that all
+    use notes.mid don't overwrite each other.
+    """
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', os.path.splitdrive(os.path.abspath(midi_path))[1]).strip('_')
+    return os.path.join(profile_dir, name + '.prof')
 
+def convert_file(midi_path, output_path=None, cache=None, profile_dir=None, trace_memory=False, seed=DEFAULT_SEED,
+                 output_lanes=DEFAULT_OUTPUT_LANES, data=None, write=write_midi_chunks):
+    """
+    Runs process_midi_file on a single path and returns a summary for batch reporting.
+    Status is 'ok', 'cached', 'already' (already converted), 'skipped' (no BEAT down beats) or 'error'.
+    With profile_dir the run is profiled with cProfile and the stats are dumped there per input.
+    data and write are passed on to process_midi_file.
+    """
+    start = time.perf_counter()
+    error = None
+    report = {}
+    if trace_memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    profiler = None
+    if profile_dir:
+        import cProfile
+        profiler = cProfile.Profile()
     try:
-        process_midi_file(midi_path)
+        if profiler is not None:
+            status = profiler.runcall(process_midi_file, midi_path, cache, output_path, report,
+                                      trace_memory=trace_memory, seed=seed, output_lanes=output_lanes,
+                                      data=data, write=write)
+        else:
+            status = process_midi_file(midi_path, cache, output_path, report, trace_memory=trace_memory, seed=seed,
+                                       output_lanes=output_lanes, data=data, write=write)
     except Exception as e:
-        print(f"Error processing {midi_path}: {e}")
+        status = 'error'
+        error = f"{type(e).__name__}: {e}"
+        logger.error("Error processing %s: %s", midi_path, e)
+    if profiler is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(profile_path(profile_dir, midi_path))
+    return {'path': midi_path, 'output': output_path or midi_path, 'status': status,
+            'error': error, 'elapsed': time.perf_counter() - start, **report}
+
+def read_input(midi_path, output_path):
+    """
+    Reads the bytes of midi_path for the batch pipeline, or returns None when output_path is already
+    up to date so resumed runs don't read files they skip anyway.
+    """
+    if output_is_current(midi_path, output_path or midi_path):
+        return None
+    with open(midi_path, 'rb') as infile:
+        return infile.read()
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <midi_file_path>")
+def convert_buffer(midi_path, output_path, data, **options):
+    """
+    Converts the already read bytes of midi_path in a worker process with convert_file, but returns
+    (summary, file_bytes) instead of writing, so the batch pipeline can leave the write to its
+    writer threads. file_bytes is None when nothing has to be written.
+    """
+    rendered = []
+    def render(path, file_type, division, chunks):
+        rendered.append(b''.join(midi_file_pieces(file_type, division, chunks)))
+    result = convert_file(midi_path, output_path, data=data, write=render, **options)
+    return result, rendered[0] if rendered else None
+
+def run_pipeline(midi_paths, output_paths, convert, workers, io_threads=DEFAULT_IO_THREADS, max_in_flight=None):
+    """
+    Converts midi_paths in three overlapping steps: a pool of io_threads reader threads prefetches the
+    file bytes, the worker processes run convert (see convert_buffer) on the in-memory buffers and
+    io_threads writer threads save the results. At most max_in_flight files (default: IN_FLIGHT_PER_WORKER
+    per worker) are between being read and written at any time, which caps the memory held in buffers.
+    Returns the per-file summaries in input order.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * IN_FLIGHT_PER_WORKER
+    results = [None] * len(midi_paths)
+    queued = iter(range(len(midi_paths)))
+    in_flight = {}  # future -> (step, index), one future per file between its read and its write
+
+    def fail(index, step, e):
+        logger.error("Error %s %s: %s", step, midi_paths[index], e)
+        result = results[index] or {'path': midi_paths[index], 'output': output_paths[index] or midi_paths[index],
+                                    'elapsed': 0.0}
+        result.update(status='error', error=f"{type(e).__name__}: {e}")
+        results[index] = result
+
+    # Spawned workers (Windows, macOS) start without the parent's logging setup
+    with ThreadPoolExecutor(io_threads, thread_name_prefix='lazylip-read') as readers, \
+            ThreadPoolExecutor(io_threads, thread_name_prefix='lazylip-write') as writers, \
+            ProcessPoolExecutor(max_workers=workers, initializer=configure_logging,
+                                initargs=(logger.getEffectiveLevel(),)) as executor:
+
+        def read_next():
+            index = next(queued, None)
+            if index is not None:
+                in_flight[readers.submit(read_input, midi_paths[index], output_paths[index])] = ('read', index)
+
+        for _ in range(max_in_flight):
+            read_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, index = in_flight.pop(future)
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    fail(index, {'read': 'reading', 'convert': 'processing', 'write': 'writing'}[step], e)
+                    read_next()
+                    continue
+                if step == 'read':
+                    in_flight[executor.submit(convert, midi_paths[index], output_paths[index], outcome)] = ('convert', index)
+                elif step == 'convert':
+                    results[index], file_bytes = outcome
+                    if file_bytes is not None:
+                        in_flight[writers.submit(write_atomic, results[index]['output'], [file_bytes])] = ('write', index)
+                    else:
+                        read_next()
+                else:
+                    read_next()
+    return results
+
+def process_batch(midi_paths, workers=None, cache=None, output_paths=None, profile_dir=None, trace_memory=False,
+                  seed=DEFAULT_SEED, output_lanes=DEFAULT_OUTPUT_LANES, io_threads=DEFAULT_IO_THREADS):
+    """
+    Converts midi_paths with a pool of worker processes (workers=None uses every CPU).
+    output_paths optionally gives the destination of each input, otherwise files are converted in place.
+    With more than one worker, reads and writes run on io_threads threads each, overlapping the
+    conversions (see run_pipeline). Returns the per-file summaries in input order plus aggregate
+    counts and throughput.
+    """
+    start = time.perf_counter()
+    output_paths = output_paths or [None] * len(midi_paths)
+    options = dict(cache=cache, profile_dir=profile_dir, trace_memory=trace_memory, seed=seed,
+                   output_lanes=output_lanes)
+    if workers == 1 or len(midi_paths) <= 1:
+        convert = partial(convert_file, **options)
+        results = [convert(path, output) for path, output in zip(midi_paths, output_paths)]
+    else:
+        results = run_pipeline(midi_paths, output_paths, partial(convert_buffer, **options), workers, io_threads)
+    if cache is not None:
+        cache.trim()
+    elapsed = time.perf_counter() - start
+
+    summary = {'files': results, 'elapsed': elapsed,
+               'files_per_sec': len(results) / elapsed if elapsed > 0 else 0.0}
+    for status in ('ok', 'cached', 'already', 'skipped', 'error'):
+        summary[status] = sum(1 for result in results if result['status'] == status)
+    return summary
+
+def watch(paths, pattern='*.mid', output_path_for=None, cache=None, seed=DEFAULT_SEED,
+          output_lanes=DEFAULT_OUTPUT_LANES, interval=WATCH_INTERVAL, debounce=WATCH_DEBOUNCE):
+    """
+    Polls paths every interval seconds and converts a MIDI file once its size and mtime have stayed the same
+    for debounce seconds. A saved file is only converted again when its BEAT or PART VOCALS tracks changed
+    (see source_key) or its output is no longer converted, so saves that touch other tracks cost one read.
+    output_path_for(midi_path, relative_path) gives the destination of a file (None converts in place).
+    Runs until interrupted.
+    """
+    handled = {}  # midi_path -> (mtime_ns, size) when it was last handled
+    pending = {}  # midi_path -> ((mtime_ns, size), time the change was first seen)
+    keys = {}     # midi_path -> source key of its last conversion
+    logger.info("Watching %s for changes, press Ctrl+C to stop", ', '.join(paths))
+    while True:
+        now = time.monotonic()
+        found = find_midi_files(paths, pattern)
+        for midi_path in set(handled) - {midi_path for midi_path, _ in found}:
+            del handled[midi_path]
+            pending.pop(midi_path, None)
+            keys.pop(midi_path, None)
+
+        for midi_path, relative_path in found:
+            try:
+                stat = os.stat(midi_path)
+            except OSError:
+                continue  # Removed or replaced since the scan
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if handled.get(midi_path) == stamp:
+                pending.pop(midi_path, None)
+                continue
+            if midi_path not in pending or pending[midi_path][0] != stamp:
+                pending[midi_path] = (stamp, now)  # Still being written, wait until it settles
+                continue
+            if now - pending[midi_path][1] < debounce:
+                continue
+            del pending[midi_path]
+            handled[midi_path] = stamp
+
+            output_path = output_path_for(midi_path, relative_path) if output_path_for else None
+            try:
+                key = source_key(midi_path, seed, output_lanes)
+            except (OSError, EOFError) as e:
+                logger.error("Error reading %s: %s", midi_path, e)
+                continue
+            if key is None:
+                logger.debug("Ignored %s, PART VOCALS is already converted", midi_path)
+                continue
+            if key == keys.get(midi_path) and is_converted_file(output_path or midi_path):
+                logger.debug("Ignored %s, BEAT and PART VOCALS are unchanged", midi_path)
+                continue
+
+            result = convert_file(midi_path, output_path, cache, seed=seed, output_lanes=output_lanes)
+            if result['status'] != 'error':
+                keys[midi_path] = key
+            if output_path is None:
+                # Converting in place changed the file, don't pick up our own write as an edit
+                try:
+                    stat = os.stat(midi_path)
+                    handled[midi_path] = (stat.st_mtime_ns, stat.st_size)
+                except OSError:
+                    pass
+            if cache is not None:
+                cache.trim()
+        time.sleep(interval)
+
+def validate_file(midi_path):
+    """
+    Validates the vocal tracks of an already converted midi_path without converting it and returns a
+    summary for batch reporting. Status is 'valid', 'invalid', 'unconverted' (PART VOCALS is not
+    lazy-lip output) or 'error'.
+    """
+    start = time.perf_counter()
+    error = None
+    diagnostics = []
+    try:
+        with open(midi_path, 'rb') as infile:
+            data = infile.read()
+        _, _, chunks = read_midi_chunks(data)
+        vocal_indices, _ = find_source_tracks(chunks)
+        if vocal_indices and all(is_converted_track(chunks[i]) for i in vocal_indices):
+            diagnostics = validate_vocals_chunks(chunks)
+            status = 'invalid' if diagnostics else 'valid'
+        else:
+            status = 'unconverted'
+    except Exception as e:
+        status = 'error'
+        error = f"{type(e).__name__}: {e}"
+        logger.error("Error validating %s: %s", midi_path, e)
+    return {'path': midi_path, 'status': status, 'error': error, 'elapsed': time.perf_counter() - start,
+            'diagnostics': diagnostics}
+
+def validate_batch(midi_paths, workers=None):
+    """
+    Runs validate_file over midi_paths with a pool of worker processes (workers=None uses every CPU)
+    and returns the per-file summaries in input order plus aggregate counts and throughput.
+    """
+    start = time.perf_counter()
+    if workers == 1 or len(midi_paths) <= 1:
+        results = [validate_file(midi_path) for midi_path in midi_paths]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        # Spawned workers (Windows, macOS) start without the parent's logging setup
+        with ProcessPoolExecutor(max_workers=workers, initializer=configure_logging,
+                                 initargs=(logger.getEffectiveLevel(),)) as executor:
+            results = list(executor.map(validate_file, midi_paths, chunksize=VALIDATE_CHUNKSIZE))
+    elapsed = time.perf_counter() - start
+
+    summary = {'files': results, 'elapsed': elapsed,
+               'files_per_sec': len(results) / elapsed if elapsed > 0 else 0.0}
+    for status in ('valid', 'invalid', 'unconverted', 'error'):
+        summary[status] = sum(1 for result in results if result['status'] == status)
+    return summary
+
+def print_validation_summary(summary):
+    for result in summary['files']:
+        if result['status'] == 'invalid':
+            counts = {}
+            for diagnostic in result['diagnostics']:
+                counts[diagnostic['type']] = counts.get(diagnostic['type'], 0) + 1
+            logger.info("%s: %s", result['path'], ', '.join(f"{count} {name}" for name, count in counts.items()))
+    logger.info("%d files: %d valid, %d invalid, %d not converted, %d errors in %.2fs (%.2f files/sec)",
+                len(summary['files']), summary['valid'], summary['invalid'], summary['unconverted'],
+                summary['error'], summary['elapsed'], summary['files_per_sec'])
+
+def print_batch_summary(summary):
+    for result in summary['files']:
+        line = f"{result['status']:>7}  {result['elapsed']:8.3f}s  {result['path']}"
+        if result['error']:
+            line += f"  ({result['error']})"
+        logger.debug(line)
+    logger.info("%d files: %d ok, %d cached, %d already converted, %d skipped (no BEAT), %d errors in %.2fs (%.2f files/sec)",
+                len(summary['files']), summary['ok'], summary['cached'], summary['already'], summary['skipped'],
+                summary['error'], summary['elapsed'], summary['files_per_sec'])
+
+def write_report(report_path, summary):
+    """
+    Writes one JSON object per converted file: status, timings and the counts gathered by process_midi_file.
+    """
+    with open(report_path, 'w', encoding='utf-8') as outfile:
+        for result in summary['files']:
+            outfile.write(json.dumps(result) + '\n')
+
+def configure_logging(level=logging.INFO):
+    logging.basicConfig(level=level, format='%(message)s')
+    logger.setLevel(level)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert Encore style pad vocals in PART VOCALS to basic Rock Band pitched vocals.")
+    parser.add_argument('paths', nargs='*', help="MIDI files, song folders or glob patterns (e.g. 'pack/**/notes.mid')")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Number of worker processes for batch runs (default: one per CPU)")
+    parser.add_argument('--io-threads', type=int, default=DEFAULT_IO_THREADS,
+                        help=f"Threads reading and writing files in parallel batch runs, each (default: {DEFAULT_IO_THREADS})")
+    parser.add_argument('--pattern', default='*.mid',
+                        help="File name pattern to match inside song folders (default: *.mid)")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('-o', '--output',
+                        help="Write the converted file here instead of overwriting the input (single input only)")
+    output.add_argument('--out-dir',
+                        help="Write converted files below this folder, mirroring the input layout. "
+                             "Up to date outputs are skipped, so interrupted runs can be resumed")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Bypass the result cache, always converting and never storing results")
+    parser.add_argument('--clear-cache', action='store_true',
+                        help="Delete every cached result before converting")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help=f"Directory of the result cache (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB,
+                        help=f"Maximum cache size in MB, least recently used results are evicted first (default: {DEFAULT_CACHE_SIZE_MB})")
+    parser.add_argument('--validate', action='store_true',
+                        help="Only check already converted files against the Magma vocal rules and print "
+                             "JSON diagnostics per file (to --report if given)")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and convert files again whenever their BEAT or PART VOCALS tracks are saved")
+    parser.add_argument('--lane', choices=PAD_LANES, default='expert',
+                        help="Pad lane of PART VOCALS that becomes the pitched vocals (default: expert)")
+    parser.add_argument('--harmonies', action='store_true',
+                        help="Also write HARM1-HARM3, sharing the phrases of PART VOCALS")
+    parser.add_argument('--harmony-lanes', default=','.join(DEFAULT_HARMONY_LANES), metavar='LANES',
+                        help="Comma separated pad lanes HARM1-HARM3 are made from with --harmonies "
+                             f"(default: {','.join(DEFAULT_HARMONY_LANES)})")
+    parser.add_argument('--report',
+                        help="Write a JSON lines report with counts and per stage timings for every file")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help=f"Base seed for lyric selection, mixed with each chart's vocals (default: {DEFAULT_SEED})")
+    parser.add_argument('--profile', metavar='DIR',
+                        help="Profile each conversion with cProfile and dump a pstats file per input into DIR")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Record the peak allocations of every stage with tracemalloc (slower)")
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument('-v', '--verbose', action='store_true', help="Log every vocal event that is changed")
+    verbosity.add_argument('-q', '--quiet', action='store_true', help="Only log warnings and errors")
+    args = parser.parse_args(argv)
+
+    configure_logging(logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO)
+    output_lanes = [('PART VOCALS', PAD_LANES[args.lane])]
+    if args.harmonies:
+        harmony_lanes = [lane.strip().lower() for lane in args.harmony_lanes.split(',')]
+        unknown = [lane for lane in harmony_lanes if lane not in PAD_LANES]
+        if unknown or len(harmony_lanes) > len(HARMONY_TRACKS):
+            parser.error(f"--harmony-lanes takes up to {len(HARMONY_TRACKS)} of {', '.join(PAD_LANES)}")
+        output_lanes += [(name, PAD_LANES[lane]) for name, lane in zip(HARMONY_TRACKS, harmony_lanes)]
+    cache = ResultCache(args.cache_dir, args.cache_size * 1024 * 1024)
+    if args.clear_cache:
+        logger.info("Removed %d cached results from %s", cache.clear(), args.cache_dir)
+        if not args.paths:
+            return
+    elif not args.paths:
+        parser.error("at least one path is required")
+
+    for path in args.paths:
+        if not os.path.isdir(path) and not any(c in path for c in '*?[') and not os.path.isfile(path):
+            logger.error("Error: The file '%s' does not exist.", path)
+            sys.exit(1)
+
+    found = find_midi_files(args.paths, args.pattern)
+    if not found and not args.watch:
+        logger.error("No MIDI files found.")
         sys.exit(1)
+    midi_paths = [midi_path for midi_path, _ in found]
+    if args.output and len(midi_paths) != 1:
+        parser.error("--output needs exactly one input file, use --out-dir for batches")
+
+    def output_path_for(midi_path, relative_path):
+        if args.output:
+            return args.output
+        if args.out_dir:
+            return os.path.join(args.out_dir, relative_path)
+        return None
+
+    if args.out_dir:
+        outputs = {}
+        for midi_path, relative_path in found:
+            output_path = os.path.normcase(os.path.abspath(output_path_for(midi_path, relative_path)))
+            if output_path in outputs:
+                parser.error(f"{outputs[output_path]} and {midi_path} would both be written to "
+                             f"{output_path_for(midi_path, relative_path)}")
+            outputs[output_path] = midi_path
+
+    if args.validate:
+        summary = validate_batch(midi_paths, workers=args.workers)
+        if args.report:
+            write_report(args.report, summary)
+        else:
+            for result in summary['files']:
+                print(json.dumps(result))
+        print_validation_summary(summary)
+        if summary['invalid'] or summary['error']:
+            sys.exit(1)
+        return
 
-    midi_path = sys.argv[1]
-    main(midi_path)
+    if args.watch:
+        try:
+            watch(args.paths, args.pattern, output_path_for, cache=None if args.no_cache else cache, seed=args.seed,
+                  output_lanes=output_lanes)
+        except KeyboardInterrupt:
+            logger.info("Stopped watching")
+        return
+
+    output_paths = None
+    if args.output or args.out_dir:
+        output_paths = [output_path_for(midi_path, relative_path) for midi_path, relative_path in found]
+
+    summary = process_batch(midi_paths, workers=args.workers, cache=None if args.no_cache else cache,
+                            output_paths=output_paths, profile_dir=args.profile, trace_memory=args.trace_memory,
+                            seed=args.seed, output_lanes=output_lanes, io_threads=args.io_threads)
+    if len(midi_paths) > 1:
+        print_batch_summary(summary)
+    if args.report:
+        write_report(args.report, summary)
+    if summary['error']:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()